@@ -1,11 +1,24 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from functools import lru_cache
+import ahocorasick
+import asyncio
 import httpx
+import logging
+import logging.handlers
+import numpy as np
 import os
+import queue
 import openai  # For GPT-4o fallback
-from typing import Dict
+import orjson
+from typing import Dict, Optional
 import re
+import time
 
 # === Microservice URLs (edit if needed) ===
 RETRO_URL = os.getenv("RETRO_URL", "https://chemgpt-se-production.up.railway.app")
@@ -13,11 +26,124 @@ EXTRACT_URL = os.getenv("EXTRACT_URL", "https://chemgpt-extract-production.up.ra
 SPECTRO_URL = os.getenv("SPECTRO_URL", "https://chemgpt-spectro-production.up.railway.app")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")  # Set this in Railway!
 
+# === Logging (handlers only enqueue; a background thread does the blocking writes) ===
+logger = logging.getLogger("gateway")
+_log_level_name = (os.getenv("LOG_LEVEL") or "INFO").upper()
+# Unknown names would make setLevel raise at import and stop the gateway from starting.
+_log_level_valid = isinstance(logging.getLevelName(_log_level_name), int)
+logger.setLevel(_log_level_name if _log_level_valid else logging.INFO)
+logger.propagate = False
+_log_queue: queue.Queue = queue.Queue(-1)
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+_log_stream = logging.StreamHandler()  # stderr
+_log_stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream)
+if not _log_level_valid:
+    logger.warning("Unknown LOG_LEVEL %r, using INFO", _log_level_name)
+
+# === Shared HTTP client (one keep-alive pool for all upstream calls) ===
+client: Optional[httpx.AsyncClient] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global client, openai_client
+    _log_listener.start()
+    client = httpx.AsyncClient(
+        timeout=httpx.Timeout(30.0),
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=300),
+        http2=True,  # multiplex concurrent /chat calls over one connection per upstream
+    )
+    try:
+        yield
+    finally:
+        await client.aclose()
+        client = None
+        if openai_client is not None:
+            await openai_client.close()
+            openai_client = None
+        _log_listener.stop()
+
+def get_client() -> httpx.AsyncClient:
+    """Dependency returning the shared client (override in tests)."""
+    return client
+
+# === Shared OpenAI client (created on first fallback so a missing key only fails that path) ===
+openai_client: Optional[openai.AsyncOpenAI] = None
+
+def get_openai_client() -> openai.AsyncOpenAI:
+    global openai_client
+    if openai_client is None:
+        openai_client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
+    return openai_client
+
+# === Per-upstream circuit breaker: after repeated failures, fail fast for a cooldown ===
+BREAKER_THRESHOLD = 5  # consecutive failures before the breaker opens
+BREAKER_COOLDOWN = 30.0  # seconds to short-circuit once open
+_breakers = {url: {"fails": 0, "open_until": 0.0} for url in (RETRO_URL, EXTRACT_URL, SPECTRO_URL)}
+
+class UpstreamOpen(Exception):
+    """Raised instead of calling an upstream whose breaker is open."""
+
+def _breaker_check(base_url: str) -> None:
+    if time.monotonic() < _breakers[base_url]["open_until"]:
+        raise UpstreamOpen(f"{base_url} is temporarily unavailable (circuit open)")
+
+def _breaker_record(base_url: str, ok: bool) -> None:
+    breaker = _breakers[base_url]
+    if ok:
+        breaker["fails"] = 0
+        return
+    breaker["fails"] += 1
+    if breaker["fails"] >= BREAKER_THRESHOLD:
+        # Stays tripped after the cooldown until a call succeeds, so one probe failure reopens it.
+        breaker["open_until"] = time.monotonic() + BREAKER_COOLDOWN
+        logger.error("Circuit open for %s after %d failures", base_url, breaker["fails"])
+
+_JSON_HEADERS = {"content-type": "application/json"}
+# Relayed bytes go to a caller that never negotiated an encoding, so ask upstream for none.
+_STREAM_HEADERS = {**_JSON_HEADERS, "accept-encoding": "identity"}
+
+async def _post_json(client: httpx.AsyncClient, base_url: str, path: str, payload: Dict):
+    """POST an orjson-encoded payload and return the orjson-decoded reply."""
+    _breaker_check(base_url)
+    try:
+        resp = await client.post(f"{base_url}{path}", content=orjson.dumps(payload), headers=_JSON_HEADERS)
+        if resp.status_code >= 500:
+            resp.raise_for_status()
+    except httpx.HTTPError:
+        _breaker_record(base_url, False)
+        raise
+    _breaker_record(base_url, True)
+    return orjson.loads(resp.content)
+
+async def _stream_post(client: httpx.AsyncClient, base_url: str, path: str, payload: Dict) -> StreamingResponse:
+    """POST a payload and relay the upstream body as-is, without decoding it."""
+    _breaker_check(base_url)
+    request = client.build_request("POST", f"{base_url}{path}", content=orjson.dumps(payload), headers=_STREAM_HEADERS)
+    try:
+        resp = await client.send(request, stream=True)
+    except httpx.HTTPError:
+        _breaker_record(base_url, False)
+        raise
+    _breaker_record(base_url, resp.status_code < 500)
+    # Content-type goes in headers, not media_type, so Starlette doesn't append a second charset.
+    headers = {"content-type": resp.headers.get("content-type", "application/json")}
+    if "content-encoding" in resp.headers:
+        headers["content-encoding"] = resp.headers["content-encoding"]
+    return StreamingResponse(
+        resp.aiter_raw(),
+        status_code=resp.status_code,
+        headers=headers,
+        background=BackgroundTask(resp.aclose),
+    )
+
 # === FastAPI App Setup ===
 app = FastAPI(
     title="ChemGPT API Gateway",
     description="Routes and orchestrates all ChemGPT microservices, with AI fallback.",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 app.add_middleware(
     CORSMiddleware,
@@ -26,6 +152,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(UpstreamOpen)
+async def upstream_open_handler(request, exc: UpstreamOpen):
+    # Direct tool endpoints fail fast; /chat catches UpstreamOpen and falls back to GPT-4o.
+    return ORJSONResponse(status_code=503, content={"detail": str(exc)})
+
 @app.get("/")
 def health():
     return {"status": "ok", "service": "gateway"}
@@ -43,136 +174,415 @@ class MoleculeRequest(BaseModel):
 class ChatRequest(BaseModel):
     question: str
 
-# === Keyword detection for spectroscopy ===
-def is_spectro_query(q: str) -> bool:
-    keywords = [
-        r"spectra", r"spectrum", r"spectroscopy", r"uv[- ]?vis", r"uv", r"ir", r"nmr",
-        r"mass spec", r"show.*spectrum", r"show.*spectra"
-    ]
-    ql = q.lower()
-    for kw in keywords:
-        if re.search(kw, ql):
-            return True
-    return False
+# Longer questions are still answered but never cached, so keys can't grow the per-worker caches unbounded.
+MAX_CACHED_QUESTION_LEN = 1024
 
-# === (Optional) You can add is_extraction_query and is_retro_query for more modularity ===
+# === Keyword routing (one Aho-Corasick pass over the question) ===
+# When several tools match, all are queried; ROUTE_PRIORITY sets the order of the answers.
+ROUTE_PRIORITY = ("EXTRACT", "SPECTRO", "RETRO")
+_EXTRACT_KWS = ("extract", "compound")
+_SPECTRO_KWS = ("spectra", "spectrum", "spectroscopy", "uv", "uvvis", "uv-vis", "ir", "ftir", "nmr", "mass spec")
+_RETRO_KWS = ("retro", "synth", "route", "smiles")
+_ROUTE_KEYWORDS = {
+    "EXTRACT": _EXTRACT_KWS,
+    "SPECTRO": _SPECTRO_KWS,
+    "RETRO": _RETRO_KWS,
+}
+# Short spectro tokens only count as whole words ("ir" must not hit "their").
+_WHOLE_WORD_KWS = frozenset(("uv", "ir", "nmr"))
+
+_ROUTE_AUTOMATON = ahocorasick.Automaton()
+for _route, _kws in _ROUTE_KEYWORDS.items():
+    for _kw in _kws:
+        _ROUTE_AUTOMATON.add_word(_kw, (_route, _kw))
+_ROUTE_AUTOMATON.make_automaton()
+
+def match_routes(ql: str) -> set:
+    """Scan the lowercased question once and return every route with a keyword hit."""
+    hits = set()
+    for end, (route, kw) in _ROUTE_AUTOMATON.iter(ql):
+        if kw in _WHOLE_WORD_KWS:
+            start = end - len(kw) + 1
+            if (start > 0 and ql[start - 1].isalnum()) or (end + 1 < len(ql) and ql[end + 1].isalnum()):
+                continue
+        hits.add(route)
+    return hits
+
+# Patterns are compiled once at import so the chat hot path never re-parses them.
+# Chat-router patterns run against the already-lowercased question, so no IGNORECASE.
+_OF_FOR_RE = re.compile(r"(?:of|for)(?: the)?\s+([a-z0-9\-\(\)\[\] ]+)")
+_STRIP_RE = re.compile(
+    r"(spectra|spectrum|spectroscopy|uv[- ]?vis|uv|ftir|ir|nmr|mass spec|show|please|plot|give|draw|for|of|the)"
+)
+_WS_RE = re.compile(r"\s+")
+_BARE_SPECTRO_WORDS = ("spectrum", "spectra", "spectroscopy", "uv", "ir", "ftir", "nmr")
+_SMILES_RE = re.compile(r'([A-Za-z0-9@+\-\[\]\(\)=#$%]+)')
+_SMILES_CHARS = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789@+-[]()=#$%/\\.")
+# Atoms allowed outside [brackets]: the SMILES organic subset (Cl/Br handled as pairs).
+_SMILES_BARE_ATOMS = frozenset("BCNOPSFIbcnops")
+
+def _is_pure_smiles(s: str) -> bool:
+    """True when the whole question is a bare SMILES string (e.g. "CCO", "c1ccccc1")."""
+    # issuperset bails on the first space, so ordinary prose exits immediately.
+    if not s or not _SMILES_CHARS.issuperset(s):
+        return False
+    # Lowercase letters only ("no", "cobs") reads as a word, not aromatic SMILES.
+    if s.isalpha() and s.islower():
+        return False
+    atoms = carbons = 0
+    halogens = False
+    open_rings = set()
+    i = 0
+    while i < len(s):
+        c = s[i]
+        if c == "[":
+            end = s.find("]", i + 1)
+            if end < 0:
+                return False
+            atoms += 1
+            i = end + 1
+            continue
+        if c == "]":
+            return False
+        if c.isdigit() or c == "%":
+            # Ring-bond labels (1-9, %nn) must come in open/close pairs.
+            label = s[i + 1:i + 3] if c == "%" else c
+            if not label.isdigit() or (c == "%" and len(label) != 2):
+                return False
+            open_rings ^= {label}
+            i += len(label) + (c == "%")
+            continue
+        if c.isalpha():
+            if s.startswith(("Cl", "Br"), i):
+                atoms += 1
+                halogens = True
+                i += 2
+                continue
+            if c not in _SMILES_BARE_ATOMS:
+                return False
+            atoms += 1
+            carbons += c in "Cc"
+        i += 1
+    if open_rings or atoms < 2:
+        return False
+    # Letters alone need a carbon chain (or Cl/Br) so acronyms like "NO", "CNS", "Co" stay questions.
+    if s.isalpha() and carbons < 2 and not halogens:
+        return False
+    return True
 
 # === Direct microservice endpoints (for internal testing or advanced use) ===
 @app.post("/retro")
-async def retro(data: RetroRequest):
+async def retro(data: RetroRequest, client: httpx.AsyncClient = Depends(get_client)):
     payload = {"smiles": data.smiles}
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(f"{RETRO_URL}/retrosynthesis", json=payload)
-        return resp.json()
+    return await _stream_post(client, RETRO_URL, "/retrosynthesis", payload)
 
 @app.post("/extract")
-async def extract(data: ExtractRequest):
+async def extract(data: ExtractRequest, client: httpx.AsyncClient = Depends(get_client)):
     payload = {"text": data.text}
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(f"{EXTRACT_URL}/extract", json=payload)
-        return resp.json()
+    return await _stream_post(client, EXTRACT_URL, "/extract", payload)
 
 @app.post("/spectro")
-async def spectro(data: MoleculeRequest):
+async def spectro(data: MoleculeRequest, client: httpx.AsyncClient = Depends(get_client)):
     payload = {"molecule": data.molecule}
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(f"{SPECTRO_URL}/spectroscopy", json=payload)
-        return resp.json()
+    return await _stream_post(client, SPECTRO_URL, "/spectroscopy", payload)
+
+# === GPT-4o answer cache: exact match first, then embedding similarity ===
+GPT_CACHE_SIZE = 2000
+GPT_CACHE_TTL = 3600.0  # seconds
+GPT_SEMANTIC_THRESHOLD = 0.95  # cosine similarity needed to reuse a cached answer
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIM = 1536
+
+_gpt_cache: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (stored_at, answer, slot)
+# Row `slot` holds the unit-length embedding of _gpt_slot_keys[slot]; free rows stay zero.
+_gpt_vectors = np.zeros((GPT_CACHE_SIZE, EMBEDDING_DIM), dtype=np.float32)
+_gpt_slot_keys: list = [None] * GPT_CACHE_SIZE
+_gpt_free_slots = list(range(GPT_CACHE_SIZE))
+
+def _gpt_cache_drop(key: str) -> None:
+    _, _, slot = _gpt_cache.pop(key)
+    _gpt_vectors[slot] = 0.0
+    _gpt_slot_keys[slot] = None
+    _gpt_free_slots.append(slot)
+
+def _gpt_cache_exact(key: str) -> Optional[str]:
+    entry = _gpt_cache.get(key)
+    if entry is None:
+        return None
+    if time.monotonic() - entry[0] > GPT_CACHE_TTL:
+        _gpt_cache_drop(key)
+        return None
+    _gpt_cache.move_to_end(key)
+    return entry[1]
+
+def _gpt_cache_similar(vector: np.ndarray) -> Optional[str]:
+    if not _gpt_cache:
+        return None
+    scores = _gpt_vectors @ vector
+    slot = int(np.argmax(scores))
+    if scores[slot] < GPT_SEMANTIC_THRESHOLD:
+        return None
+    return _gpt_cache_exact(_gpt_slot_keys[slot])
+
+def _gpt_cache_put(key: str, answer: str, vector: Optional[np.ndarray]) -> None:
+    if key in _gpt_cache:
+        _gpt_cache_drop(key)
+    elif len(_gpt_cache) >= GPT_CACHE_SIZE:
+        _gpt_cache_drop(next(iter(_gpt_cache)))
+    slot = _gpt_free_slots.pop()
+    if vector is not None:  # without an embedding the entry is exact-match only
+        _gpt_vectors[slot] = vector
+    _gpt_slot_keys[slot] = key
+    _gpt_cache[key] = (time.monotonic(), answer, slot)
+
+async def _embed(client: openai.AsyncOpenAI, text: str) -> Optional[np.ndarray]:
+    try:
+        response = await client.embeddings.create(model=EMBEDDING_MODEL, input=text)
+    except Exception as e:
+        logger.error("Embedding failed, semantic cache skipped: %s", e)
+        return None
+    vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+    return vector / (np.linalg.norm(vector) or 1.0)
 
 # === GPT-4o Fallback Function ===
 async def fallback_gpt4o(query: str) -> str:
     """Call GPT-4o for fallback if no tool matches or errors occur."""
-    client = openai.OpenAI(api_key=OPENAI_API_KEY)
-    response = client.chat.completions.create(
+    key = _WS_RE.sub(" ", query.strip().lower())
+    cacheable = len(key) <= MAX_CACHED_QUESTION_LEN
+    if cacheable:
+        answer = _gpt_cache_exact(key)
+        if answer is not None:
+            return answer
+
+    client = get_openai_client()
+    vector = await _embed(client, key) if cacheable else None
+    if vector is not None:
+        answer = _gpt_cache_similar(vector)
+        if answer is not None:
+            return answer
+
+    response = await client.chat.completions.create(
         model="gpt-4o",
         messages=[{"role": "user", "content": query}],
         temperature=0.3,
         max_tokens=700
     )
-    return response.choices[0].message.content
+    answer = response.choices[0].message.content
+    if cacheable:
+        _gpt_cache_put(key, answer, vector)
+    return answer
 
-# === Main "Brain" Chat Endpoint ===
-@app.post("/chat")
-async def chat_router(data: ChatRequest) -> Dict:
-    q = data.question.strip()
-    ql = q.lower()
+# === Chat tool payloads (pure CPU: safe to build off the event loop) ===
+def _extract_payload(q: str, qn: str) -> Dict:
+    return {"text": q}
 
-    try:
-        # === Extraction Tool ===
-        if "extract" in ql or "compound" in ql:
-            payload = {"text": q}
-            async with httpx.AsyncClient() as client:
-                resp = await client.post(f"{EXTRACT_URL}/extract", json=payload)
-                answer = await resp.json()
-            return {
-                "type": "extract",
-                "answer": answer,
-                "tool": "ChemDataExtractor"
-            }
-
-        # === Spectroscopy Tool ===
-        elif is_spectro_query(q):
-            # 1. Try "of/for <mol>" pattern (case-insensitive)
-            match = re.search(r"(?:of|for|of the|for the)\s+([a-zA-Z0-9\-\(\)\[\] ]+)", q, re.IGNORECASE)
-            if match:
-                mol = match.group(1).strip()
+def _parse_molecule(qn: str) -> str:
+    if len(qn) > MAX_CACHED_QUESTION_LEN:
+        return _extract_molecule(qn)
+    return _extract_molecule_cached(qn)
+
+def _extract_molecule(qn: str) -> str:
+    """Pull the molecule name out of a whitespace-normalized spectroscopy question.
+
+    Patterns match the lowercased text, but the name is sliced from `qn` so formula case
+    ("Co" vs "CO") reaches the spectro service intact.
+    """
+    ql = qn.lower()
+    if len(ql) != len(qn):  # rare Unicode case folds change length; offsets would drift
+        qn = ql
+
+    # 1. Try "of/for <mol>" pattern
+    match = _OF_FOR_RE.search(ql)
+    if match:
+        mol = qn[match.start(1):match.end(1)].strip()
+    else:
+        # 2. Fallback: remove keywords, what’s left is probably the molecule
+        pieces, last = [], 0
+        for kw in _STRIP_RE.finditer(ql):
+            pieces.append(qn[last:kw.start()])
+            last = kw.end()
+        pieces.append(qn[last:])
+        mol = "".join(pieces).strip()
+
+    # 3. Edge cases: if empty, default to "benzene"
+    if not mol or mol.lower() in _BARE_SPECTRO_WORDS:
+        mol = "benzene"
+
+    return mol.strip(",.;: ")
+
+_extract_molecule_cached = lru_cache(maxsize=4096)(_extract_molecule)
+
+def _spectro_payload(q: str, qn: str) -> Dict:
+    mol = _parse_molecule(qn)
+    logger.debug("Spectro parsed mol=%s q=%s", mol, q)
+    return {"molecule": mol}
+
+def _retro_payload(q: str, qn: str) -> Dict:
+    smiles = None
+    if _is_pure_smiles(q):
+        smiles = q
+    else:
+        match = _SMILES_RE.search(q)
+        if match:
+            smiles = match.group(1)
+    if not smiles:
+        smiles = "c1ccccc1"
+    return {"smiles": smiles}
+
+ROUTE_PAYLOADS = {
+    "EXTRACT": _extract_payload,
+    "SPECTRO": _spectro_payload,
+    "RETRO": _retro_payload,
+}
+
+# Questions longer than this are classified in a worker thread so the event loop keeps serving.
+CLASSIFY_OFFLOAD_THRESHOLD = 1024
+
+def _classify_and_parse(q: str) -> tuple:
+    """Normalize, route and build each matched tool's payload; returns (ql, {route: payload})."""
+    # Whitespace collapsed; the lowercased form is shared by routing and the caches.
+    qn = _WS_RE.sub(" ", q)
+    ql = qn.lower()
+    hits = match_routes(ql)
+    if not hits and _is_pure_smiles(q):
+        # A bare SMILES carries no routing keyword; send it straight to retrosynthesis.
+        hits = {"RETRO"}
+    payloads = {route: ROUTE_PAYLOADS[route](q, qn) for route in ROUTE_PRIORITY if route in hits}
+    return ql, payloads
+
+# === Chat tool calls (one per route; each returns the /chat answer dict) ===
+async def _call_extract(client: httpx.AsyncClient, payload: Dict) -> Dict:
+    answer = await _post_json(client, EXTRACT_URL, "/extract", payload)
+    return {
+        "type": "extract",
+        "answer": answer,
+        "tool": "ChemDataExtractor"
+    }
+
+async def _call_spectro(client: httpx.AsyncClient, payload: Dict) -> Dict:
+    answer = await _post_json(client, SPECTRO_URL, "/spectroscopy", payload)
+    return {
+        "type": "spectro",
+        "answer": answer,
+        "tool": "ChemGPT Spectro"
+    }
+
+async def _call_retro(client: httpx.AsyncClient, payload: Dict) -> Dict:
+    answer = await _post_json(client, RETRO_URL, "/retrosynthesis", payload)
+    return {
+        "type": "retro",
+        "answer": answer,
+        "tool": "AiZynthFinder"
+    }
+
+ROUTE_CALLS = {
+    "EXTRACT": _call_extract,
+    "SPECTRO": _call_spectro,
+    "RETRO": _call_retro,
+}
+
+# === /chat response cache (exact match on the upstream payloads) ===
+CHAT_CACHE_SIZE = 1024
+CHAT_CACHE_TTL = 300.0  # seconds
+_chat_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+def _cache_get(key: tuple) -> Optional[Dict]:
+    entry = _chat_cache.get(key)
+    if entry is None:
+        return None
+    stored_at, payload = entry
+    if time.monotonic() - stored_at > CHAT_CACHE_TTL:
+        del _chat_cache[key]
+        return None
+    _chat_cache.move_to_end(key)
+    return payload
+
+def _cache_put(key: tuple, payload: Dict) -> None:
+    _chat_cache[key] = (time.monotonic(), payload)
+    _chat_cache.move_to_end(key)
+    if len(_chat_cache) > CHAT_CACHE_SIZE:
+        _chat_cache.popitem(last=False)
+
+async def _dispatch_chat(client: httpx.AsyncClient, q: str, payloads: Dict) -> Dict:
+    """Answer with the matched tools (GPT-4o if none); raises if every tool fails."""
+    # === Single tool ===
+    if len(payloads) == 1:
+        (route, payload), = payloads.items()
+        return await ROUTE_CALLS[route](client, payload)
+
+    # === Several tools matched: query them concurrently ===
+    elif payloads:
+        results = await asyncio.gather(
+            *(ROUTE_CALLS[route](client, payload) for route, payload in payloads.items()),
+            return_exceptions=True,
+        )
+        answers = []
+        for route, result in zip(payloads, results):
+            if isinstance(result, Exception):
+                logger.error("%s tool failed: %s", route, result)
+                answers.append({"type": route.lower(), "error": str(result)})
             else:
-                # 2. Fallback: remove keywords, what’s left is probably the molecule
-                mol = re.sub(
-                    r"(spectra|spectrum|spectroscopy|uv[- ]?vis|uv|ir|nmr|mass spec|show|please|plot|give|draw|for|of|the)",
-                    "", q, flags=re.IGNORECASE
-                ).strip()
-
-            # 3. Edge cases: if empty, default to "benzene"
-            if not mol or mol.lower() in ["spectrum", "spectra", "spectroscopy", "uv", "ir", "nmr"]:
-                mol = "benzene"
-
-            mol = mol.strip(",.;: ")
-            print(f"🔬 [DEBUG] Spectro request parsed molecule: '{mol}' from question: '{q}'")
-
-            payload = {"molecule": mol}
-            async with httpx.AsyncClient() as client:
-                resp = await client.post(f"{SPECTRO_URL}/spectroscopy", json=payload)
-                answer = await resp.json()
-            return {
-                "type": "spectro",
-                "answer": answer,
-                "tool": "ChemGPT Spectro"
-            }
-
-        # === Retrosynthesis Tool ===
-        elif any(word in ql for word in ["retro", "synth", "route", "smiles"]):
-            smiles = None
-            match = re.search(r'([A-Za-z0-9@+\-\[\]\(\)=#$%]+)', q)
-            if match:
-                smiles = match.group(1)
-            if not smiles:
-                smiles = "c1ccccc1"
-            payload = {"smiles": smiles}
-            async with httpx.AsyncClient() as client:
-                resp = await client.post(f"{RETRO_URL}/retrosynthesis", json=payload)
-                answer = await resp.json()
-            return {
-                "type": "retro",
-                "answer": answer,
-                "tool": "AiZynthFinder"
-            }
-
-        # === Fallback: GPT-4o handles ANY other chemistry Q ===
-        else:
-            answer = await fallback_gpt4o(q)
-            return {
-                "type": "gpt4o",
-                "answer": answer,
-                "tool": "GPT-4o"
-            }
+                answers.append(result)
+        if all("error" in answer for answer in answers):
+            raise RuntimeError("all matched tools failed")
+        return {
+            "type": "multi",
+            "answers": answers
+        }
+
+    # === Fallback: GPT-4o handles ANY other chemistry Q ===
+    else:
+        answer = await fallback_gpt4o(q)
+        return {
+            "type": "gpt4o",
+            "answer": answer,
+            "tool": "GPT-4o"
+        }
 
+async def _answer_chat(client: httpx.AsyncClient, q: str, payloads: Dict, cache_key: Optional[tuple]) -> Dict:
+    try:
+        result = await _dispatch_chat(client, q, payloads)
     except Exception as e:
         # === If a tool fails, fallback to GPT-4o, and log the error ===
-        print(f"❌ [ERROR] Tool failed, fallback to GPT-4o: {str(e)}")
+        logger.error("Tool failed, fallback to GPT-4o: %s", e)
         answer = await fallback_gpt4o(q)
         return {
             "type": "gpt4o",
             "answer": answer,
             "tool": "GPT-4o (fallback due to error)"
         }
+
+    # Only fully successful answers are cached; partial multi-tool failures are retried.
+    if cache_key is not None and not any("error" in answer for answer in result.get("answers", ())):
+        _cache_put(cache_key, result)
+    return result
+
+# === Request coalescing: in-flight requests with the same cache key share one upstream call ===
+_inflight: Dict[tuple, asyncio.Task] = {}
+
+# === Main "Brain" Chat Endpoint ===
+@app.post("/chat")
+async def chat_router(data: ChatRequest, client: httpx.AsyncClient = Depends(get_client)) -> Dict:
+    q = data.question.strip()
+    if len(q) > CLASSIFY_OFFLOAD_THRESHOLD:
+        ql, payloads = await asyncio.to_thread(_classify_and_parse, q)
+    else:
+        ql, payloads = _classify_and_parse(q)
+
+    # Key on what is actually sent upstream: SMILES and molecule names are case-sensitive.
+    # Only the no-tool GPT-4o route falls back to the normalized question.
+    cache_key = (tuple(payloads), orjson.dumps(payloads)) if payloads else ((), ql)
+    cacheable = len(q) <= MAX_CACHED_QUESTION_LEN
+    if cacheable:
+        cached = _cache_get(cache_key)
+        if cached is not None:
+            return cached
+
+    # No await between the lookup and the insert, so the event loop needs no lock here.
+    task = _inflight.get(cache_key)
+    if task is None:
+        task = asyncio.ensure_future(_answer_chat(client, q, payloads, cache_key if cacheable else None))
+        _inflight[cache_key] = task
+        task.add_done_callback(lambda _: _inflight.pop(cache_key, None))
+    # shield: one caller disconnecting must not cancel the call the others are waiting on
+    return await asyncio.shield(task)